@@ -10,12 +10,70 @@
 #
 
 from datetime import date
-from os import path, makedirs, unlink, rename
-from shutil import copytree, rmtree
+from os import path, makedirs, unlink, rename, name, scandir
+from shutil import copytree, rmtree, copyfileobj
 from subprocess import run
-from glob import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import tarfile
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import HTTPError as StreamError
+
+
+# HTTP session shared by all downloads, keeps connections alive between
+# requests and retries transient server errors:
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=8, pool_maxsize=8,
+    max_retries=Retry(
+        total=3, backoff_factor=0.5, raise_on_status=False,
+        status_forcelist=(500, 502, 503, 504),
+    ),
+))
+
+# Maximum of simultaneous downloads from a single server:
+MAXDOWNLOADS = 4
+
+
+def rmdir(folder: str) -> None:
+    """Remove a folder and its contents. On Windows the native
+    'rd' command is used, much faster than shutil for folders with
+    many files, with shutil.rmtree as fallback.
+
+    Keyword arguments:
+    folder -- path to the folder to remove.
+    """
+
+    if name == "nt":
+        if run(["cmd", "/c", "rd", "/s", "/q", folder]).returncode != 0:
+            print("WARNING: rd failed to remove", folder)
+
+    if path.isdir(folder):
+        rmtree(folder)
+
+
+def cpdir(src: str, dst: str) -> None:
+    """Copy a folder and its contents. On Windows robocopy is used
+    (multi-threaded), with shutil.copytree as fallback.
+
+    Keyword arguments:
+    src -- path to the folder to copy;
+    dst -- path to the new folder.
+    """
+
+    if name == "nt":
+        cmd = ["robocopy", src, dst, "/E", "/MT:16", "/NFL", "/NDL",
+               "/NJH", "/NJS"]
+        # robocopy exit codes below 8 mean success:
+        if run(cmd).returncode < 8:
+            return
+
+        print("WARNING: robocopy failed to copy", src)
+        rmdir(dst)
+
+    copytree(src, dst)
 
 
 def getbkup(fdate:date, scdir: str) -> int:
@@ -38,13 +96,52 @@ def getbkup(fdate:date, scdir: str) -> int:
     bkup = path.join(scdir, fdate.strftime("BKUP\\%y%m%d"))
     if path.isdir(bkup):
         print("Copying backup folder:", path.basename(bkup))
-        copytree(bkup, diout)
+        cpdir(bkup, diout)
         return 0
 
     # If the needed folder is not found, return error:
     return 1
 
 
+def download(link: str, fout: str) -> int:
+    """Download file from an URL link. The output file is left
+    as is if the download fails, so that it can run in threads.
+    
+    Keyword arguments:
+    link -- URL link;
+    fout -- output file name.
+    """
+
+    # Download URL, streamed to the output file in 1 MiB blocks:
+    print("Downloading from", link)
+    try:
+        with SESSION.get(link, stream=True, timeout=(10, 60)) as response:
+            status = response.status_code
+
+            # Check download success:
+            if status != 200:
+                print("HTTPError:", status)
+                return 1
+
+            # Output file:
+            with open(fout, "wb") as dat:
+                copyfileobj(response.raw, dat, length=1 << 20)
+            size = int(response.headers.get("Content-Length", "0"))
+
+    # Timeouts and connection errors (also while streaming the raw
+    # response) fail this file only:
+    except (requests.RequestException, StreamError) as err:
+        print("RequestException:", err)
+        return 1
+
+    # Check downloaded size when the server sends it:
+    if size and path.getsize(fout) != size:
+        print("Download incomplete:", path.basename(fout))
+        return 1
+
+    return 0
+
+
 def webrequest(link: str, fout: str) -> int:
     """Download file from an URL link. Removes the output
     file directory if the download fails.
@@ -54,19 +151,66 @@ def webrequest(link: str, fout: str) -> int:
     fout -- output file name.
     """
 
-    # Download URL:
-    print("Downloading from", link)
-    response = requests.get(link)
-    status = response.status_code
+    if download(link, fout) > 0:
+        rmdir(path.dirname(fout))
+        return 1
+
+    return 0
+
+
+def webrequests(links: list, fouts: list,
+                workers: int = MAXDOWNLOADS) -> int:
+    """Download files from several URL links concurrently. Removes
+    the output files directory if any download fails.
+    
+    Keyword arguments:
+    links -- URL links;
+    fouts -- output files names, in the same order as links;
+    workers -- maximum number of simultaneous downloads.
+    """
+
+    # Each download is bound by network latency, not by CPU:
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        status = list(pool.map(download, links, fouts))
+
+    if any(status):
+        rmdir(path.dirname(fouts[0]))
+        return 1
+
+    return 0
 
-    # Check download success:
-    if status != 200:
-        print("HTTPError:", status)
-        rmtree(path.dirname(fout))
+
+def untar(ftgz: str, outdir: str) -> int:
+    """Extract a downloaded .TGZ file. Archives with members that
+    would be written outside of the output directory, or that are
+    not regular files or folders, are rejected.
+    
+    Keyword arguments:
+    ftgz -- path to the .TGZ file;
+    outdir -- output directory.
+    """
+
+    try:
+        with tarfile.open(ftgz, "r:gz") as tgz:
+            # Python's own data filter, when available:
+            if hasattr(tarfile, "data_filter"):
+                tgz.extractall(path=outdir, filter="data")
+                return 0
+
+            root = path.realpath(outdir)
+            for member in tgz.getmembers():
+                fout = path.realpath(path.join(root, member.name))
+                inside = path.commonpath([root, fout]) == root
+                if not inside or not (member.isfile() or member.isdir()):
+                    print("Unsafe member in", ftgz + ":", member.name)
+                    return 1
+
+            tgz.extractall(path=outdir)
+
+    except tarfile.TarError as err:
+        print("TarError:", err)
         return 1
 
-    # Output file:
-    open(fout, "wb").write(response.content)
     return 0
 
 
@@ -81,13 +225,15 @@ def amseas(fdate: date, scdir: str, nouts: int) -> int:
 
     # Output directory:
     diout = path.join(scdir, fdate.strftime("Download\\%y%m%d"))
-    if path.isdir(diout): rmtree(diout)
+    if path.isdir(diout): rmdir(diout)
     makedirs(diout)
 
     # Initiate download, URL prefix:
     prfx = "https://nomads.ncep.noaa.gov/pub/data/nccf/com/ncom/prod/ncom."
     prfx += fdate.strftime("%Y%m%d/amseas_u_ocn_ncout_grid1_%Y%m%d00_t")
     
+    # AMSEAS URLs and output files paths:
+    urls, fouts = [], []
     for nout in range(nouts):
         # Define AMSEAS URL:
         if nout < 1:
@@ -95,24 +241,52 @@ def amseas(fdate: date, scdir: str, nouts: int) -> int:
         else:
             url = prfx + f"{(nout*24) + 1:04d}-{(nout + 1)*24:04d}.tgz"
 
-        # Output file path:
-        fout = path.join(diout, f"AMSEAS_{nout}.tgz")
-        if webrequest(url, fout) > 0: return 1
+        urls.append(url)
+        fouts.append(path.join(diout, f"AMSEAS_{nout}.tgz"))
 
-        # Extract netCDFs from AMSEAS compressed file and remove it:
-        cmd = "tar -xvzf " + fout + " -C " + path.dirname(fout)
-        run(cmd, shell=True)
-        unlink(fout)
+    # Download files concurrently and extract each one as soon as it
+    # arrives, so decompression overlaps the downloads still running:
+    failed = 0
+    with ThreadPoolExecutor(max_workers=MAXDOWNLOADS) as pool:
+        jobs = {pool.submit(download, url, fout): fout
+                for url, fout in zip(urls, fouts)}
+
+        for job in as_completed(jobs):
+            if job.cancelled():
+                continue
+
+            # Extract netCDFs from AMSEAS compressed file and remove it,
+            # nothing else is extracted once a file has failed:
+            status = job.result()
+            if not (status or failed):
+                status = untar(jobs[job], diout)
+                unlink(jobs[job])
+
+            # Report every failed file, downloads not started are cancelled:
+            if status:
+                print("WARNING: AMSEAS file FAILED", path.basename(jobs[job]))
+                failed = 1
+                for other in jobs:
+                    other.cancel()
+
+    # Remove the output directory if any download or extraction failed:
+    if failed:
+        rmdir(diout)
+        return 1
+    
+    # Rename extracted files (single directory scan):
+    with scandir(diout) as entries:
+        ncs = sorted(ntc.path for ntc in entries if ntc.name.endswith(".nc"))
     
-    # Rename extracted files:
-    ncs = sorted(glob(diout + "\\*.nc"))
+    fouts = []
     for id, ntc in enumerate(ncs):
         fout = diout + fdate.strftime(f"\\AMSEAS_%y%m%d_{id*3:03d}.nc")
         rename(ntc, fout)
+        fouts.append(fout)
     
     # When downloading only one compressed file, the netCDF
     # which contains D+1 data needs to be removed:
-    if nout < 2: unlink(sorted(glob(diout + "\\*.nc"))[-1])
+    if nout < 2: unlink(fouts[-1])
     
     return 0
 
@@ -121,19 +295,25 @@ def gfs(fdate: date, scdir: str, nouts: int):
     
     # Output directory:
     diout = path.join(scdir, fdate.strftime("Download\\%y%m%d"))
-    if path.isdir(diout): rmtree(diout)
+    if path.isdir(diout): rmdir(diout)
     makedirs(diout)
 
     # Initiate download, URL prefix:
     prfx = "https://nomads.ncep.noaa.gov/pub/data/nccf/com/gfs/prod/gfs."
     prfx += fdate.strftime("%Y%m%d/00/atmos/gfs.t00z.sfluxgrbf")
     
-    for nout in range(1, nouts + 1):
-        # Define GFS URL:
-        url = prfx + f"{nout:03d}.grib2"
+    # GFS URLs and output files paths:
+    urls = [prfx + f"{nout:03d}.grib2" for nout in range(1, nouts + 1)]
+    fouts = [diout + fdate.strftime(f"\\GFS_%y%m%d_{nout:03d}.grib2")
+             for nout in range(1, nouts + 1)]
 
-        # Output file path:
-        fout = diout + fdate.strftime(f"\\GFS_%y%m%d_{nout:03d}.grib2")
-        if webrequest(url, fout) > 0: return 1
+    # Download files concurrently, each one is bound by network latency:
+    with ThreadPoolExecutor(max_workers=MAXDOWNLOADS) as pool:
+        status = list(pool.map(download, urls, fouts))
+
+    # Remove the output directory if any download failed:
+    if any(status):
+        rmdir(diout)
+        return 1
     
     return 0
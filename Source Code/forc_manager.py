@@ -40,15 +40,26 @@ def forc_manager(forc_inpts, manager):
             makedirs(folder)
 
     log = manager.root + "\\run.log"
-    if not path.isfile(log):
-        with open(log, "w") as entry:
-            entry.write("Date;Time;Status\n")
-    #
-    # log entry:
-    #
+    newlog = not path.isfile(log)
+    # single log handle for the whole process (line buffered), closed
+    # however the process ends:
+    with open(log, "a", buffering=1) as log:
+        if newlog:
+            log.write("Date;Time;Status\n")
+        forc_process(forc_inpts, manager, log, mesg)
+
+
+def forc_process(forc_inpts, manager, log, mesg):
+    """forc_inpts = the dictionary with the inputs read from init.dat
+       manager = forc_operations.ForcOp object
+       log = open run.log file object
+       mesg = string with the email subject prefix
+
+       Runs the processes of forc_manager for a single source. Each log
+       entry is written as a whole line, which reaches the file at once
+       with the line buffered log."""
+
     opdate = forc_inpts.get('opdate')
-    with open(log, "a") as entry:
-        entry.write(str(opdate) + ";")
     #
     # run backup:
     #
@@ -78,8 +89,7 @@ def forc_manager(forc_inpts, manager):
     mail = forc_inpts.get("MAILTO", "")
     status = manager.download()
     if not status:
-        with open(log, "a") as entry:
-            entry.write(str(datetime.today()) + ";ERR01\n")
+        log.write(f"{opdate};{datetime.today()};ERR01\n")
         body = str(opdate) + "\nDownload failed."
         mailreport(mail, mesg + "FAILED", body, ())
         return
@@ -111,8 +121,7 @@ def forc_manager(forc_inpts, manager):
     #
     # end operations for one source:
     #
-    with open(log, "a") as entry:
-        entry.write(str(datetime.today()) + ";1\n")
+    log.write(f"{opdate};{datetime.today()};1\n")
     body = str(opdate) + "\nOperation completed."
     mailreport(mail, mesg + "COMPLETED", body, ())
     
\ No newline at end of file
@@ -6,12 +6,13 @@
 
 
 from datetime import datetime, timedelta
-from os import path, mkdir, unlink, rename
+from os import path, mkdir, unlink, rename, cpu_count, scandir
 from glob import glob
 from shutil import move, rmtree, copyfile, copytree
 from subprocess import run
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
-import requests
 import xarray as xr
 import numpy as np
 import pygrib
@@ -21,6 +22,100 @@ import forc_lib
 from support_initkey import readkey
 
 
+#
+# GFS convertible variables (by GRIB message number):
+#
+GFSKEYS = (
+    "var", "unit", "long_name", "GRIB_typeOfLevel",
+    "GRIB_stepType", "GRIB_level", "conversion",
+)
+
+GFSBANDS = {
+    6: (
+        "surface_air_pressure", "Pa", "Surface pressure",
+        "surface", "instant", 0, lambda x: x,
+    ),  
+    33: (
+        "air_temperature", "degC", "2 metre temperature",
+        "heightAboveGround", "instant", 2, lambda x: x - 273.16,
+    ),
+    34: (
+        "specific_humidity", "kg kg-1", "2 metre specific humidity",
+        "heightAboveGround", "instant", 2, lambda x: x,
+    ),
+    39: (
+        "eastward_wind", "m s-1", "10 metre U wind component",
+        "heightAboveGround", "instant", 10, lambda x: x,
+    ),
+    40: (
+        "northward_wind", "m s-1", "10 metre V wind component",
+        "heightAboveGround", "instant", 10, lambda x: x,
+    ),
+    68: (
+        "pwat", "kg m-2", "Precipitable water",
+        "atmosphereSingleLayer", "instant", 0, lambda x: x,
+    ),
+    84: (
+        "tcc", "-", "Total cloud cover",
+        "convectiveCloudLayer", "instant", 0, lambda x: x/100,
+    ),
+    # 113: (
+    #     "surface_albedo", "%", "Albedo",
+    #     "surface", "avg", 0, lambda x: x,
+    # ),
+}
+
+
+def gfs2nc(grb_name, grid, outdir):
+    """grb_name = string with path and name of the GFS GRIB2 file
+       grid = iterable (list/tuple) with the grid limits as in
+       (min latitude, max latitude, min longitude, max longitude)
+       outdir = string with the path to save the netCDF file
+       
+       Converts the GFSBANDS of a single GFS file to netCDF. Module level
+       function, so it can run in a separate process."""
+
+    print(grb_name)
+    dims = ("time", "latitude", "longitude")
+    grb = pygrib.open(grb_name)
+    dsout = xr.Dataset()
+
+    # Needed GRIB messages, in a single pass through the file:
+    msgs = {band.messagenumber: band for band in grb
+            if band.messagenumber in GFSBANDS}
+    
+    # Iterate variables:
+    for msg in GFSBANDS.keys():
+        # Grib message attributes and data as np.ndarray:
+        attrs = dict(zip(GFSKEYS, GFSBANDS.get(msg)))
+        print(" /" + attrs.get("var"))
+        
+        band = msgs[msg]
+        data, lat, lon = band.data(
+            lat1=grid[0], lat2=grid[1], lon1=grid[2]%360, lon2=grid[3]%360,
+        )
+
+        # Update unit and add one dimension to data (time):
+        data = np.array([attrs.pop("conversion")(data)])
+        # Update output xr.Dataset:
+        dsout.update({attrs.pop("var"): (dims, data, attrs)})
+
+    # Dimensions information from the last GRIB message:
+    print(" /time")
+    support_xrdset.xrtime([band.validDate,], dsout)
+    print(" /latitude")
+    dsout = support_xrdset.xrlat(lat.transpose()[0], dsout)
+    print(" /longitude")
+    dsout = support_xrdset.xrlon(lon[0], dsout, 180)
+
+    grb.close()
+
+    # Output file
+    fout = path.splitext(path.basename(grb_name))[0] + ".nc"
+    fout = path.join(outdir, fout)
+    dsout.to_netcdf(fout, encoding=support_xrdset.xrencode_simple(dsout))
+
+
 class ForcOp:
     def __init__(self, forc_inpts):
         """forc_inpts = the dictionary with the inputs read from init.dat"""
@@ -124,17 +219,21 @@ class ForcOp:
         ext = parms[0]
         keep = parms[1]
         
-        for folder in glob(self.root + "\\Download\\*"):
-            if path.isfile(folder):
-                continue
-            
-            # leave current forecast folder in downloads:
-            dirdate = datetime.strptime(path.basename(folder), "%y%m%d")
-            if dirdate.toordinal() == self.today.toordinal():
-                continue
+        # single directory pass for folders and for their files:
+        with scandir(self.root + "\\Download") as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
                 
-            outdirs.append(folder)
-            files += glob(folder + "\\*" + ext)
+                # leave current forecast folder in downloads:
+                dirdate = datetime.strptime(entry.name, "%y%m%d")
+                if dirdate.toordinal() == self.today.toordinal():
+                    continue
+                    
+                outdirs.append(entry.path)
+                with scandir(entry.path) as dentries:
+                    files += [file.path for file in dentries
+                              if file.name.endswith(ext)]
         
         # remove out-of-range files:
         for file in files:
@@ -189,20 +288,27 @@ class ForcOp:
         
         logs = outdir + '\\run.log', outdir + '\\run_error.log'
 
-        # set command line and run download:
-        cmd = 'python -m motuclient --motu https://nrt.cmems-du.eu/motu-web'
-        cmd += '/Motu --service-id GLOBAL_ANALYSIS_FORECAST_PHY_001_024-TDS '
-        cmd += '--product-id global-analysis-forecast-phy-001-024 --longitude'
-        cmd += f'-min {self.grid[2]} --longitude-max {self.grid[3]} --latitude'
-        cmd += f'-min {self.grid[0]} --latitude-max {self.grid[1]} --date-min '
-        cmd += f'"{str(self.ini)} 12:00:00" --date-max "{str(self.fin)} '
-        cmd += '12:00:00" --depth-min 0.493 --depth-max 5727.918000000001 '
-        cmd += '--variable so --variable thetao --variable uo --variable vo '
-        cmd += f'--out-dir "{outdir}" --out-name "Mercator.nc" --user '
-        cmd += f'"{cred[0]}" --pwd "{cred[1]}" > {logs[0]} 2> {logs[1]}'
-        
-        print('Downloading Mercator netCDF file...\n' + cmd, end="\n\n")
-        run(cmd, shell=True)
+        # set command line and run download (without a shell):
+        cmd = ['python', '-m', 'motuclient', '--motu',
+               'https://nrt.cmems-du.eu/motu-web/Motu', '--service-id',
+               'GLOBAL_ANALYSIS_FORECAST_PHY_001_024-TDS', '--product-id',
+               'global-analysis-forecast-phy-001-024',
+               '--longitude-min', str(self.grid[2]),
+               '--longitude-max', str(self.grid[3]),
+               '--latitude-min', str(self.grid[0]),
+               '--latitude-max', str(self.grid[1]),
+               '--date-min', f'{str(self.ini)} 12:00:00',
+               '--date-max', f'{str(self.fin)} 12:00:00',
+               '--depth-min', '0.493', '--depth-max', '5727.918000000001',
+               '--variable', 'so', '--variable', 'thetao',
+               '--variable', 'uo', '--variable', 'vo',
+               '--out-dir', outdir, '--out-name', 'Mercator.nc',
+               '--user', cred[0], '--pwd', cred[1]]
+        
+        print('Downloading Mercator netCDF file...\n' + " ".join(cmd),
+              end="\n\n")
+        with open(logs[0], "w") as out, open(logs[1], "w") as err:
+            run(cmd, stdout=out, stderr=err)
 
         # check downloaded file:
         if not path.isfile(outdir + '\\Mercator.nc'):
@@ -243,19 +349,26 @@ class ForcOp:
         ini = ini + timedelta(hours=23.5)
         fin = ini + timedelta(hours=self.fcth)
 
-        cmd = "python -m motuclient --motu https://nrt.cmems-du.eu/motu-web/Mo"
-        cmd += "tu --service-id GLOBAL_ANALYSIS_FORECAST_PHY_001_024-TDS --pro"
-        cmd += "duct-id global-analysis-forecast-phy-001-024-hourly-t-u-v-ssh "
-        cmd += f"--longitude-min {self.grid[2]} --longitude-max {self.grid[3]}"
-        cmd += f" --latitude-min {self.grid[0]} --latitude-max {self.grid[1]} "
-        cmd += f'--date-min "{str(ini)}" --date-max "{str(fin)}" --depth-min '
-        cmd += f'{dep} --depth-max {dep} --variable thetao --variable uo '
-        cmd += f'--variable vo --variable zos --out-dir "{outdir}" --out-name '
-        cmd += f'"Mercator.nc" --user "{cred[0]}" --pwd "{cred[1]}" > '
-        cmd += f'"{logs[0]}" 2> "{logs[1]}"'
-        
-        print('Downloading Mercator netCDF file...\n' + cmd, end="\n\n")
-        run(cmd, shell=True)
+        cmd = ['python', '-m', 'motuclient', '--motu',
+               'https://nrt.cmems-du.eu/motu-web/Motu', '--service-id',
+               'GLOBAL_ANALYSIS_FORECAST_PHY_001_024-TDS', '--product-id',
+               'global-analysis-forecast-phy-001-024-hourly-t-u-v-ssh',
+               '--longitude-min', str(self.grid[2]),
+               '--longitude-max', str(self.grid[3]),
+               '--latitude-min', str(self.grid[0]),
+               '--latitude-max', str(self.grid[1]),
+               '--date-min', str(ini), '--date-max', str(fin),
+               '--depth-min', str(dep), '--depth-max', str(dep),
+               '--variable', 'thetao', '--variable', 'uo',
+               '--variable', 'vo', '--variable', 'zos',
+               '--out-dir', outdir, '--out-name', 'Mercator.nc',
+               '--user', cred[0], '--pwd', cred[1]]
+        
+        print('Downloading Mercator netCDF file...\n' + " ".join(cmd),
+              end="\n\n")
+        # run download without a shell:
+        with open(logs[0], "w") as out, open(logs[1], "w") as err:
+            run(cmd, stdout=out, stderr=err)
 
         # check downloaded file:
         if not path.isfile(outdir + '\\Mercator.nc'):
@@ -463,25 +576,21 @@ class ForcOp:
             
             mkdir(outdir)
 
+            # URLs and output files names of the day:
+            urls, fnames = [], []
             for out in range(0, nouts, 3):
-                # output file name:
                 fname = outdir
                 fname += fdate.strftime(f"\\NAM_%y%m%d_{out:03d}.grib2")
                 print(path.basename(fname))
                 
                 url = prefix + f"{out:02d}" + sufix + fdate.strftime("%Y%m%d")
-                
-                # print(url)
-                fweb = requests.get(url)  # file in web
-                status = fweb.status_code
-                if status != 200:
-                    print(self.mesg, 'NAM download error', status)
-                    rmtree(outdir)
-                    return
-                
-                # get bytes from fweb and wrtite in fout:
-                with open(fname, 'wb') as fout:
-                    fout.write(fweb.content)
+                urls.append(url)
+                fnames.append(fname)
+
+            # stream files to disk concurrently, removes outdir if any fails:
+            if forc_lib.webrequests(urls, fnames) > 0:
+                print(self.mesg, 'NAM download error')
+                return
         
             if len(glob(outdir + "\\*.grib2")) < (nouts - 1)/3:
                 print(self.mesg, 'NAM downloaded files missing')
@@ -532,92 +641,11 @@ class ForcOp:
         for folder in glob(self.root + "\\Download\\*"):
             grbs += glob(folder + "\\*.grib2")
 
-        # Convertible variables:
-        keys = (
-            "var", "unit", "long_name", "GRIB_typeOfLevel",
-            "GRIB_stepType", "GRIB_level", "conversion",
-        )
-
-        bands = {
-            6: (
-                "surface_air_pressure", "Pa", "Surface pressure",
-                "surface", "instant", 0, lambda x: x,
-            ),  
-            33: (
-                "air_temperature", "degC", "2 metre temperature",
-                "heightAboveGround", "instant", 2, lambda x: x - 273.16,
-            ),
-            34: (
-                "specific_humidity", "kg kg-1", "2 metre specific humidity",
-                "heightAboveGround", "instant", 2, lambda x: x,
-            ),
-            39: (
-                "eastward_wind", "m s-1", "10 metre U wind component",
-                "heightAboveGround", "instant", 10, lambda x: x,
-            ),
-            40: (
-                "northward_wind", "m s-1", "10 metre V wind component",
-                "heightAboveGround", "instant", 10, lambda x: x,
-            ),
-            68: (
-                "pwat", "kg m-2", "Precipitable water",
-                "atmosphereSingleLayer", "instant", 0, lambda x: x,
-            ),
-            84: (
-                "tcc", "-", "Total cloud cover",
-                "convectiveCloudLayer", "instant", 0, lambda x: x/100,
-            ),
-            # 113: (
-            #     "surface_albedo", "%", "Albedo",
-            #     "surface", "avg", 0, lambda x: x,
-            # ),
-        }
-        
-        dims = ("time", "latitude", "longitude")
-        
-        # Iterate grib files:
+        # Iterate grib files, one process per file:
         print("Converting GFS files to netCDF...")
-        for grb_name in grbs:
-            print(grb_name)
-            grb = pygrib.open(grb_name)
-            dsout = xr.Dataset()
-            
-            # Iterate variables:
-            for msg in bands.keys():
-                # Grib message attributes and data as np.ndarray:
-                attrs = dict(zip(keys, bands.get(msg)))
-                print(" /" + attrs.get("var"))
-                
-                data = grb.message(msg).data(
-                    lat1=self.grid[0], lat2=self.grid[1],
-                    lon1=self.grid[2]%360, lon2=self.grid[3]%360,
-                )[0]
-
-                # Update unit and add one dimension to data (time):
-                data = np.array([attrs.pop("conversion")(data)])
-                # Update output xr.Dataset:
-                dsout.update({attrs.pop("var"): (dims, data, attrs)})
-
-            # Get dimensions information from last GRIB message:
-            band = grb.message(msg)
-            data, lat, lon = band.data(
-                lat1=self.grid[0], lat2=self.grid[1],
-                lon1=self.grid[2]%360, lon2=self.grid[3]%360,
-            )
-            
-            print(" /time")
-            support_xrdset.xrtime([band.validDate,], dsout)
-            print(" /latitude")
-            dsout = support_xrdset.xrlat(lat.transpose()[0], dsout)
-            print(" /longitude")
-            dsout = support_xrdset.xrlon(lon[0], dsout, 180)
-
-            grb.close()
-
-            # Output file
-            fout = path.splitext(path.basename(grb_name))[0] + ".nc"
-            fout = path.join(outdir, fout)
-            dsout.to_netcdf(fout, encoding=support_xrdset.xrencode_simple(dsout))
+        nwrks = max(1, min(len(grbs), cpu_count() or 1))
+        with ProcessPoolExecutor(nwrks) as pool:
+            list(pool.map(gfs2nc, grbs, repeat(self.grid), repeat(outdir)))
 
         # merge netCDFs:
         fout = ForcOp.download_output(self)
@@ -672,17 +700,19 @@ class ForcOp:
         # last time number of digits:
         ndigits = len(str(df["DS"][-1]))
 
-        # write time series:
-        with open(fout, "w") as dat:
+        # format all lines at once, DS zero padded and values with
+        # 5 decimals, columns separated by spaces:
+        vals = np.char.mod("%.5f", df[df.columns[1:]].to_numpy("f8"))
+        lines = np.char.zfill(df["DS"].to_numpy().astype(str), ndigits)
+        lines = np.char.add(lines, " ")
+        for col, vcol in enumerate(vals.T):
+            sep = " " if col else ""
+            lines = np.char.add(np.char.add(lines, sep), vcol)
+
+        # write time series (1 MiB write buffer):
+        with open(fout, "w", buffering=1 << 20) as dat:
             dat.write("TIME_UNITS         : SECONDS\n")
             dat.write(dfini + lat + lon)
             dat.write(varlist + "\n<BeginTimeSerie>\n")
-    
-            for row in range(df.shape[0]):
-                line = df.iloc[row].tolist()
-                dstime = int(line.pop(0))
-                dstime = '{num:0{width}} '.format(num=dstime, width=ndigits)
-                line = [f"{val:.5f}" for val in line]
-                dat.write(dstime + " ".join(line) + "\n")
-    
+            dat.write("\n".join(lines.tolist()) + "\n")
             dat.write("<EndTimeSerie>\n")
@@ -6,7 +6,7 @@
 #
 
 from datetime import datetime
-from multiprocessing.dummy import freeze_support
+from multiprocessing import freeze_support
 from subprocess import run
 from time import time
 
@@ -10,6 +10,8 @@ from glob import glob
 from datetime import timedelta, datetime
 from shutil import rmtree
 from time import sleep
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
 
 import paramiko
 import numpy as np
@@ -17,11 +19,75 @@ import xarray as xr
 from cftime import num2pydate
 
 from support_conv2nc import hdf2xrdset
-from support_xrdset import xrencode, xrtime, xrencode_simple
+from support_xrdset import xrencode, xrtime, xrencode_simple, xrchunks
 from support_mohid import mergeintime, hdf2nc
 
 
-def uploadsftp(finp, outdir, serv, user, pwrd):
+# SFTP channel window size (bytes), simultaneous uploads and attempts:
+SFTPWINDOW = 4 * 1024 * 1024
+SFTPWORKERS = 4
+SFTPTRIES = 3
+SFTPTIMEOUT = 10  # connection, banner and authentication (seconds)
+
+
+def sftpupload(transport, files, outdir):
+    """transport = paramiko.Transport of the open SSH connection
+       files = list of strings with path and name of the files to upload
+       outdir = string with remote output directory
+    
+       Supporting function of uploadsftp. Uploads a batch of files with
+       its own SFTP channel over the shared connection, the channel is
+       closed when the batch ends. Failed uploads are tried again
+       (SFTPTRIES) in a new channel, waiting longer each time.
+       Returns the list of files not uploaded."""
+
+    fails = []
+    sftp = None
+    try:
+        for file in files:
+            fout = posixpath.join(outdir, path.basename(file))
+
+            for attempt in range(SFTPTRIES):
+                try:
+                    if sftp is None:
+                        sftp = paramiko.SFTPClient.from_transport(
+                            transport, window_size=SFTPWINDOW)
+                    # no channel, retried as any other SSH failure:
+                    if sftp is None:
+                        raise paramiko.SSHException("SFTP channel not opened")
+
+                    print(file)
+                    sftp.put(file, fout)
+                    # overwrites files with same name
+                    break
+
+                except (OSError, paramiko.SSHException) as err:
+                    print(f"WARNING: upload attempt {attempt + 1} FAILED,",
+                          err)
+                    # reopen the channel in the next attempt:
+                    if sftp is not None:
+                        sftp.close()
+                        sftp = None
+                    sleep(0.5 * 2**attempt)
+            else:
+                fails.append(file)
+    finally:
+        if sftp is not None:
+            sftp.close()
+
+    return fails
+
+
+def uploadsftp(finp, outdir, serv, user, pwrd, compress=False):
+    """finp = iterable (list/tuple) with the path and name of the files
+       outdir = string with remote output directory
+       serv, user, pwrd = strings with SFTP server, user and password
+       compress = SSH transport compression switch, off by default since
+       the netCDF files are already compressed
+       
+       Uploads the files in 'finp' to 'outdir' in the SFTP server.
+       Returns 1 if all files were uploaded."""
+
     print("Uploading files to SFTP...")
     print("SERVER:", serv)
     print("OUTPUT DIRECTORY:", outdir)
@@ -30,26 +96,50 @@ def uploadsftp(finp, outdir, serv, user, pwrd):
         # set up connection:
         #
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(serv, username=user, password=pwrd)
+        # password login only, no agent or key files probing:
+        try:
+            client.connect(serv, username=user, password=pwrd,
+                           compress=compress, timeout=SFTPTIMEOUT,
+                           banner_timeout=SFTPTIMEOUT,
+                           auth_timeout=SFTPTIMEOUT,
+                           allow_agent=False, look_for_keys=False)
+        except (paramiko.SSHException, OSError) as err:
+            print("WARNING: SFTP connection FAILED,", err)
+            return
         #
-        # open SFTP:
+        # open SFTP with a larger window (more writes in flight):
         #
-        sftp = client.open_sftp()
+        transport = client.get_transport()
+        sftp = paramiko.SFTPClient.from_transport(
+            transport, window_size=SFTPWINDOW)
+        if sftp is None:
+            print("WARNING: SFTP channel FAILED to open")
+            return
         #
-        # create remote output directory:
+        # create remote output directory, before any upload:
         #
         try:
             sftp.mkdir(outdir)
         except OSError:
             print("WARNING: output directory already exists.")
+        sftp.close()
         #
-        # upload files and close connection:
+        # upload files in SFTPWORKERS batches, each with its own SFTP
+        # channel over the same SSH connection:
         #
-        for file in finp:
-            print(file)
-            sftp.put(file, outdir + "/" + path.basename(file))
-            # overwrites files with same name
-        sftp.close()
+        finp = list(finp)
+        batches = [finp[wrk::SFTPWORKERS] for wrk in range(SFTPWORKERS)]
+        with ThreadPoolExecutor(SFTPWORKERS) as pool:
+            jobs = [pool.submit(sftpupload, transport, batch, outdir)
+                    for batch in batches if batch]
+            fails = [file for job in jobs for file in job.result()]
+        #
+        # report files not uploaded:
+        #
+        for file in fails:
+            print("WARNING: file not uploaded", file)
+
+    return None if fails else 1
 
 
 def convertpde(resdir, outdir, opdate):
@@ -94,6 +184,13 @@ def convertpde(resdir, outdir, opdate):
         #
         encd = xrencode(xrdset, 8)
         #
+        # surface (2D) encoding, chunks without depth dimension:
+        #
+        xrsurf = xrdset.isel(depth=0)
+        encd2d = {varid: dict(encd[varid]) for varid in encd}
+        for varid in xrsurf.data_vars:
+            encd2d[varid]["chunksizes"] = xrchunks(xrsurf[varid])
+        #
         # update dimensions attributes:
         #     
         for varid in xrdset.dims:
@@ -168,7 +265,7 @@ def convertpde(resdir, outdir, opdate):
 
             # output file name and write netCDF at surface:
             fout = num2pydate(inital, unit, cale).strftime("hv-%Y%m%d%H")
-            xrout.isel(depth=0).to_netcdf(prfx + fout + sufx, encoding=encd)
+            xrout.isel(depth=0).to_netcdf(prfx + fout + sufx, encoding=encd2d)
     #
     # upload files after midnight
     # calculate sleep time:
@@ -183,7 +280,7 @@ def convertpde(resdir, outdir, opdate):
     serv =  "your_server"
     user = "your_user"
     pwrd = "your_password"
-    uploadsftp(ncs, "online_directory", serv, user, pwrd)
+    return uploadsftp(ncs, "online_directory", serv, user, pwrd)
 
 
 def convertbasic(fmtdir, outdir, opdate):
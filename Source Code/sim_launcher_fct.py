@@ -25,9 +25,25 @@ def sim_forecast(inpts):
        the function sim_forecast. The basic operations are imported
        from the class methods of the module sim_operations.py"""
     #
-    # create an instance of the class SimOp and set up environment:
+    # create an instance of the class SimOp, its log file is closed
+    # however the forecast ends:
     #
     manager = SimOp(inpts, "Forecast")
+    try:
+        forecast_run(manager, inpts)
+    finally:
+        manager.close()
+
+
+def forecast_run(manager, inpts):
+    """manager = sim_operations.SimOp object of the forecast
+       inpts = a copy of the dictionary with the treated inputs
+       read from init.dat
+    
+       Runs the forecast operations of sim_forecast."""
+    #
+    # set up environment:
+    #
     manager.environment()
     #
     # check forecast range:
@@ -35,9 +51,7 @@ def sim_forecast(inpts):
     fctrange = inpts.get("forecast")
     if fctrange < 1:
         print("Module " + __name__ + " ERROR: null forecast range")
-        manager.logentry(datetime.today().isoformat() + ";ERR04\n")
-        body = str(manager.opdate) + " - Null forecast range."
-        mailreport(manager.mail, manager.sbj + "ERROR", body, ())
+        manager.errreport("ERR04", " - Null forecast range.")
         return
     print("FORECAST RANGE:", fctrange, "day(s).", end="\n\n")
     #
@@ -107,9 +121,7 @@ def sim_forecast(inpts):
             manager.runfin = manager.runini + timedelta(fctrange)
         
     if fctrange < 1:
-        manager.logentry(datetime.today().isoformat() + ";ERR02\n")
-        body = str(manager.opdate) + " - Missing forcing data."
-        mailreport(manager.mail, manager.sbj + "ERROR", body, ())
+        manager.errreport("ERR02", " - Missing forcing data.")
         return
     #
     # check start time:
@@ -121,10 +133,9 @@ def sim_forecast(inpts):
 
     if fctrange < 1:
         print("ERROR: forecast range is less than one day.")
-        manager.logentry(datetime.today().isoformat() + ";ERR05\n")
-        body = str(manager.opdate) + " - Forecast range reduced due to "
-        body += "external forcing sources with different start times."
-        mailreport(manager.mail, manager.sbj + "ERROR", body, ())
+        body = " - Forecast range reduced due to external forcing "
+        body += "sources with different start times."
+        manager.errreport("ERR05", body)
         return
 
     # change forecast dates ranges to datetime.datetime object:
@@ -207,7 +218,10 @@ def sim_forecast(inpts):
     # PDE conversion:
     if "PDESFTP" in special:
         outdir = manager.root + "\\Operations\\PDE"
-        post_special.convertpde(resdir, outdir, manager.opdate)
+        status = post_special.convertpde(resdir, outdir, manager.opdate)
+        if not status:
+            body = str(manager.opdate) + " - PDE SFTP upload FAILED."
+            mailreport(manager.mail, manager.sbj + "ERROR", body, ())
 
     # BASIC thredds:
     if "BASIC_THREDD" in special:
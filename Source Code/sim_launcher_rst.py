@@ -11,7 +11,6 @@ from math import ceil
 import numpy as np
 
 from sim_operations import SimOp
-from support_mailing import mailreport
 
 
 def sim_restart(inpts):
@@ -23,9 +22,25 @@ def sim_restart(inpts):
        the function sim_restart. The basic operations are imported
        from the class methods of the module sim_operations.py"""
     #
-    # create an instance of the class SimOp and set up the enrironment:
+    # create an instance of the class SimOp, its log file is closed
+    # however the restart ends:
     #
     manager = SimOp(inpts, "Restart")
+    try:
+        restart_run(manager, inpts)
+    finally:
+        manager.close()
+
+
+def restart_run(manager, inpts):
+    """manager = sim_operations.SimOp object of the restart
+       inpts = a copy of the dictionary with the treated inputs
+       read from init.dat
+       
+       Runs the restart operations of sim_restart."""
+    #
+    # set up the enrironment:
+    #
     manager.environment()
     #
     # check restart range:
@@ -33,9 +48,7 @@ def sim_restart(inpts):
     rstrange = np.array(inpts.pop("restart"))
     if 0 in tuple(rstrange):
         print("Module " + __name__ + " ERROR: null restart range")
-        manager.logentry(datetime.today().isoformat() + ";ERR04")
-        body = str(manager.opdate) + " - Null forecast range."
-        mailreport(manager.mail, manager.sbj + "ERROR", body, ())
+        manager.errreport("ERR04", " - Null forecast range.")
         return        
     #
     # check model initial conditions:
@@ -76,9 +89,7 @@ def sim_restart(inpts):
         status = manager.checktsdat(src)
 
     if not status:
-        manager.logentry(datetime.today().isoformat() + ";ERR02\n")
-        body = str(manager.opdate) + " - Missing forcing data."
-        mailreport(manager.mail, manager.sbj + "ERROR", body, ())
+        manager.errreport("ERR02", " - Missing forcing data.")
         return
     #
     # check start time:
@@ -5,13 +5,13 @@
 # Updated : 2022-02-05
 #
 
-from os import path, mkdir, chdir
+from os import path, mkdir, scandir
 from shutil import rmtree, copyfile, copytree
 from datetime import datetime, timedelta
 from glob import glob
 from subprocess import run
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
 import numpy as np
 
 from support_mohid import readlog
@@ -45,7 +45,13 @@ class SimOp:
         self.levels = inpts.get("levels")
         self.mail = inpts.get("MAILTO")
 
+        # relative path of each level, "\\Level 1", "\\Level 1\\Level 2"...
+        lvdirs = [f"Level {level + 1}" for level in range(self.levels)]
+        self.lvpaths = ["\\" + "\\".join(lvdirs[:level + 1])
+                        for level in range(self.levels)]
+
         self.smsclog = self.root + "\\Operations\\LOGS\\smsc_run.log"
+        self.logdat = None  # log file, opened at the first entry
         self.msg = "Module " + __name__ + " ERROR: "
         self.sbj = path.basename(self.smsc) + f" {root} "
 
@@ -67,8 +73,45 @@ class SimOp:
             mkdir(folder)
 
     def logentry(self, entry):
-        with open(self.smsclog, "a") as log:
-            log.write(entry)
+        # kept open, flushed on every write so that partial entries (as
+        # "opdate;" before the simulation) are not lost if the run dies:
+        if not self.logdat:
+            self.logdat = open(self.smsclog, "a", buffering=1)
+        self.logdat.write(entry)
+        self.logdat.flush()
+
+    def close(self):
+        """Method to close the SMS-Coastal run log file. Launchers call
+           it when the run ends, it is safe to call more than once."""
+        
+        # logdat may be missing if __init__ failed before setting it:
+        logdat = getattr(self, "logdat", None)
+        if logdat:
+            logdat.close()
+            self.logdat = None
+
+    def __del__(self):
+        SimOp.close(self)
+
+    def errreport(self, code, mesg, logs=()):
+        """code = string with the SMS-Coastal error code, as in ERR02
+           mesg = string appended to the operation date in the email body
+           logs = list/tuple of files to attach to the email
+
+           Method to report a failed operation. Writes the error code to the
+           SMS-Coastal log file and sends the error report email."""
+
+        SimOp.logentry(self, datetime.today().isoformat() + f";{code}\n")
+        body = str(self.opdate) + mesg
+        mailreport(self.mail, self.sbj + "ERROR", body, logs)
+
+    def outstamp(self):
+        """Returns the suffix for output directories made of the operation
+           date and the current date and time, as in YYMMDD_ordinalTHHMM."""
+        
+        outdate = datetime.today()
+        stamp = f"{outdate.toordinal()}T{outdate:%H%M}"
+        return self.opdate.strftime("\\%y%m%d_") + stamp
 
     def environment(self):
         print("Preparing simulation environment...")
@@ -77,9 +120,7 @@ class SimOp:
         SimOp.redefinedir(self, "\\General Data\\Operational Forcing")
 
         # remove last simulation results and executables:
-        lvpath = ""
-        for level in range(self.levels):
-            lvpath += f"\\Level {level+1}"
+        for lvpath in self.lvpaths:
             SimOp.redefinedir(self, lvpath + "\\exe")
             SimOp.redefinedir(self, lvpath + "\\res")
 
@@ -95,11 +136,8 @@ class SimOp:
         # write tree.dat MOHID file:
         tree = "Automatic Generated Tree File\n"
         tree += "by FERNANDOs AWESOME PYTHON BASED PROGRAM\n"
-        lvpath = ""
-        
-        for level in range(self.levels):
-            lvpath += f"\\Level {level+1}"
-            tree += "+"*(level + 1) + self.root + lvpath + "\\exe\n"
+        tree += "".join(f"{'+'*(level + 1)}{self.root}{lvpath}\\exe\n"
+                        for level, lvpath in enumerate(self.lvpaths))
         
         with open(self.root + "\\Level 1\\exe\\Tree.dat", "w") as dat:
             dat.write(tree)
@@ -113,12 +151,9 @@ class SimOp:
         print("FIN files at:", finsdir)
 
         if not path.isdir(finsdir):
-            entry = datetime.today().isoformat() + ";ERR01\n"
-            SimOp.logentry(self, entry)
             print("<<>>"*19)
             print(self.msg + "FINS files missing")
-            body = str(self.opdate) + " FINS files missing."
-            mailreport(self.mail, self.sbj + "ERROR", body, ())
+            SimOp.errreport(self, "ERR01", " FINS files missing.")
             print("<<>>"*19)
             return
         
@@ -128,9 +163,7 @@ class SimOp:
                 "GOTM": "\\GOTM_0.fin"}
 
         # copy to each level:
-        lvpath = ""
-        for level in range(self.levels):
-            lvpath += f"\\Level {level+1}"
+        for level, lvpath in enumerate(self.lvpaths):
             fipt = glob(finsdir + f"\\LV{level+1:02d}_*.fin*")
 
             for file in fipt:
@@ -152,33 +185,24 @@ class SimOp:
         srchdfs = glob(srcpath + "\\*_LV" + self.modtype + ".hdf5")
         srchdfs = [path.basename(hdf) for hdf in srchdfs]
 
-        # create a data frame with files names and dates:
-        df = pd.DataFrame({"file": srchdfs,
-                           "process": [hdf.split("_")[1] for hdf in srchdfs],
-                           "initial": [hdf.split("_")[2] for hdf in srchdfs],
-                           "final": [hdf.split("_")[3] for hdf in srchdfs]})
-
-        # change dates columns to datetime.datetime objects:
-        for col in df.columns:
-            if col == "file":
-                continue   
-            df[col] = pd.to_datetime(df[col], format="%y%m%d")
+        # dates range as YYMMDD strings, which sort like the dates:
+        inikey = self.runini.strftime("%y%m%d")
+        finkey = self.runfin.strftime("%y%m%d")
 
-        # sort files from newer from older:
-        df.sort_values(by="process", ascending=False, inplace=True)
-        df.reset_index(drop=True, inplace=True)
-
-        # filter files to date range:
-        filt = (df["initial"] <= self.runini) & (df["final"] >= self.runfin)
-        df = df.loc[filt].reset_index(drop=True)
+        # newest processed file that covers the date range:
+        process, filein = "", None
+        for hdf in srchdfs:
+            info = hdf.split("_")
+            if info[2] <= inikey and info[3] >= finkey and info[1] > process:
+                process, filein = info[1], hdf
 
         # ruturn if no file is found for the date range:
-        if df.empty:
+        if not filein:
             return
 
         # get input files names:
         # file name as: Mercator_220107_220101_220110_LV2.hdf5
-        filein = df.loc[0, "file"].split("_")[:-1]
+        filein = filein.split("_")[:-1]
         filein = sorted(glob(srcpath + "\\" + "_".join(filein) + "_LV*.hdf5"))
 
         # output folder:
@@ -203,35 +227,25 @@ class SimOp:
         # NAM_opdate_ini_fin.dat
         srcpath = self.smsc + "\\FORC\\" + src + "\\Data"
         srcts = [path.basename(dat) for dat in glob(srcpath + "\\*.dat")]
-        srcts_info = [path.splitext(dat)[0].split("_")[1:] for dat in srcts]
-
-        # create a data frame with files names and dates:
-        df = pd.DataFrame({"file": srcts,
-                           "process": [tsinfo[0] for tsinfo in srcts_info],
-                           "initial": [tsinfo[1] for tsinfo in srcts_info],
-                           "final": [tsinfo[2] for tsinfo in srcts_info]})
 
-        # change dates columns to datetime.datetime objects:
-        for col in df.columns:
-            if col == "file":
-                continue   
-            df[col] = pd.to_datetime(df[col], format="%y%m%d")
+        # dates range as YYMMDD strings, which sort like the dates:
+        inikey = self.runini.strftime("%y%m%d")
+        finkey = self.runfin.strftime("%y%m%d")
 
-        # sort files from newer from older:
-        df.sort_values(by="process", ascending=False, inplace=True)
-        df.reset_index(drop=True, inplace=True)
-
-        # filter files to date range:
-        filt = (df["initial"] <= self.runini) & (df["final"] >= self.runfin)
-        df = df.loc[filt].reset_index(drop=True)
+        # newest processed file that covers the date range:
+        process, filein = "", None
+        for dat in srcts:
+            info = path.splitext(dat)[0].split("_")[1:]
+            if info[1] <= inikey and info[2] >= finkey and info[0] > process:
+                process, filein = info[0], dat
 
         # ruturn if no file is found for the date range:
-        if df.empty:
+        if not filein:
             return
 
         # get input file name:
         # file name as: Mercator_220107_220101_220110.dat
-        filein = srcpath + "\\" + df.loc[0, "file"]
+        filein = srcpath + "\\" + filein
         print(filein)
 
         # output file:
@@ -304,10 +318,11 @@ class SimOp:
            MOHID executable. After the simulation code checks if the run was
            successful."""
 
-        lvpath = ""
-        for level in range(self.levels):
-            lvpath += f"\\Level {level + 1}"
-            
+        # simulation dates, the same for all levels:
+        runini = self.runini.strftime("%Y %m %d %H %M %S\n")
+        runfin = self.runfin.strftime("%Y %m %d %H %M %S\n")
+
+        for level, lvpath in enumerate(self.lvpaths):
             # copy nopmfich:
             nfich = self.root + lvpath + f"\\data\\Nomfich_{self.runid}.dat"
             copyfile(nfich, self.root + lvpath + "\\exe\\Nomfich.dat")
@@ -317,23 +332,22 @@ class SimOp:
 
             # create Model_rundid.dat:
             nfich = path.dirname(nfich) + f"\\Model_{self.runid}.dat"
+            lines = ["START        : " + runini,
+                     "END          : " + runfin,
+                     "DT           : " + str(self.rundt[level]) + "\n",
+                     "VARIABLEDT   : 0\n",
+                     "GMTREFERENCE : " + gmt + "\n"]
             with open(nfich, "w") as dat:
-                dat.write("START        : ")
-                dat.write(self.runini.strftime("%Y %m %d %H %M %S\n"))
-                dat.write("END          : ")
-                dat.write(self.runfin.strftime("%Y %m %d %H %M %S\n"))
-                dat.write("DT           : " + str(self.rundt[level]) + "\n")
-                dat.write("VARIABLEDT   : 0\n")
-                dat.write("GMTREFERENCE : " + gmt + "\n")
-
-        # change working directory and run MOHID:
-        chdir(self.root + "\\Level 1\\exe")
+                dat.writelines(lines)
+
+        # run MOHID from level 1 exe folder, without a shell:
+        exedir = self.root + "\\Level 1\\exe"
         cmd = self.root + f"\\Operations\\LOGS\\mohid_"
         logs = cmd + f"run{self.runid}.txt", cmd + f"err{self.runid}.txt"
-        cmd = self.smsc + "\\MOHID\\MOHIDWater.exe > "
+        cmd = self.smsc + "\\MOHID\\MOHIDWater.exe"
         print("Running MOHID executable...")
-        run(cmd + logs[0] + " 2> " + logs[1], shell=True)
-        chdir(self.smsc)
+        with open(logs[0], "w") as out, open(logs[1], "w") as err:
+            run([cmd], stdout=out, stderr=err, cwd=exedir)
         print("Simulation COMPLETED.", end="\n\n")
 
         # check mohid log file
@@ -341,11 +355,9 @@ class SimOp:
         if status:
             return 1
 
-        SimOp.logentry(self, datetime.today().isoformat() + ";ERR03\n")
         print("<<>>"*19)
         print(self.msg + "Simulation stopped")
-        body = str(self.opdate) + " Simulation ERROR."
-        mailreport(self.mail, self.sbj + "ERROR", body, logs)
+        SimOp.errreport(self, "ERR03", " Simulation ERROR.", logs)
         print("<<>>"*19)
 
         # save failue files:
@@ -392,27 +404,36 @@ class SimOp:
         SimOp.redefinedir(self, findir)
         findir = self.root + findir
         #
-        # iterate model levels and copy fins:
+        # copy fins of each model level in parallel:
         #
-        lvpath = ""
-        for level in range(self.levels):
-            lvpath += f"\\Level {level + 1}"
-
-            # fin files location:
-            finloc = self.root + lvpath + f"\\res\\*_{self.runid}"
-
-            # glob opdate + timedelta(1) fins as input files:
-            fipt = glob(finloc + findate.strftime("_%Y%m%d-*.fin*"))
-
-            # glob last fins if 'lastfin' is on or if there is no files
-            # in fipt (in case of a one-day simulation):
-            if (lastfin > 0) or (not fipt):
-                fipt = glob(finloc + ".fin*")
-
-            # copy files:
-            for file in fipt:
-                fout = findir + f"\\LV{level + 1:02d}_" + path.basename(file)
-                copyfile(file, fout)
+        finpatt = findate.strftime("_%Y%m%d-*.fin*")
+        with ThreadPoolExecutor(max_workers=self.levels) as pool:
+            jobs = [pool.submit(SimOp.lvfins, self, level, lvpath, findir,
+                                finpatt, lastfin)
+                    for level, lvpath in enumerate(self.lvpaths)]
+        # surface exceptions raised in the workers:
+        for job in jobs:
+            job.result()
+
+    def lvfins(self, level, lvpath, findir, finpatt, lastfin):
+        """Supporting method of savefins to copy the fins of a single model
+           level. Levels write to disjoint files, so it runs in a thread."""
+
+        # fin files location:
+        finloc = self.root + lvpath + f"\\res\\*_{self.runid}"
+
+        # glob opdate + timedelta(1) fins as input files:
+        fipt = glob(finloc + finpatt)
+
+        # glob last fins if 'lastfin' is on or if there is no files
+        # in fipt (in case of a one-day simulation):
+        if (lastfin > 0) or (not fipt):
+            fipt = glob(finloc + ".fin*")
+
+        # copy files:
+        for file in fipt:
+            fout = findir + f"\\LV{level + 1:02d}_" + path.basename(file)
+            copyfile(file, fout)
 
     def saveres(self):
         """Method to save MOHID forecast and restart simulation output files,
@@ -422,37 +443,48 @@ class SimOp:
         # define results directory:
         resdir = "\\Operations\\RES"
         SimOp.definedir(self, resdir)
-        resdir = self.root + resdir + self.opdate.strftime("\\%y%m%d_")
-        outdate = datetime.today()
-        resdir += str(outdate.toordinal()) + outdate.strftime("T%H%M")
+        resdir = self.root + resdir + SimOp.outstamp(self)
         mkdir(resdir)
 
-        # iterate model levels and copy results:
-        lvpath = ""
-        for level in range(self.levels):
-            lvpath += f"\\Level {level + 1}"
-
-            # files location:
-            floc = self.root + lvpath + "\\res\\"
-
-            # hdfs:
-            hdfs = glob(floc + "Hydrodynamic_*.hdf5")
-            hdfs += glob(floc + "WaterProperties_*.hdf5")
-            # time series folders:
-            tsdir = glob(floc + "Run*")
-
-            # copy hdfs:
-            for file in hdfs:
-                fout = resdir + f"\\LV{level + 1:02d}_" + path.basename(file)
-                copyfile(file, fout)
-            
-            #c copy timeseries folders:
-            for folder in tsdir:
-                fout = resdir + f"\\LV{level + 1:02d}_TimeSeries_"
-                copytree(folder, fout + path.basename(folder))
+        # copy results of each model level in parallel:
+        with ThreadPoolExecutor(max_workers=self.levels) as pool:
+            jobs = [pool.submit(SimOp.lvres, self, level, lvpath, resdir)
+                    for level, lvpath in enumerate(self.lvpaths)]
+        # surface exceptions raised in the workers:
+        for job in jobs:
+            job.result()
                 
         return resdir
 
+    def lvres(self, level, lvpath, resdir):
+        """Supporting method of saveres to copy the results of a single
+           model level. Levels write to disjoint files, so it runs in a
+           thread."""
+
+        # files location:
+        floc = self.root + lvpath + "\\res\\"
+
+        # hdfs and time series folders, in a single directory pass:
+        hdfs, tsdir = [], []
+        prfxs = "Hydrodynamic_", "WaterProperties_"
+        with scandir(floc) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.startswith(prfxs) and name.endswith(".hdf5"):
+                    hdfs.append(entry.path)
+                elif name.startswith("Run") and entry.is_dir():
+                    tsdir.append(entry.path)
+
+        # copy hdfs:
+        for file in hdfs:
+            fout = resdir + f"\\LV{level + 1:02d}_" + path.basename(file)
+            copyfile(file, fout)
+        
+        #c copy timeseries folders:
+        for folder in tsdir:
+            fout = resdir + f"\\LV{level + 1:02d}_TimeSeries_"
+            copytree(folder, fout + path.basename(folder))
+
     def savefail(self, logs):
         """Method to save MOHID output files when a simulation finishes with
            error. Copies all data from the 'res' folder of each level to an
@@ -461,22 +493,17 @@ class SimOp:
         # define output directory:
         outdir = "\\Operations\\FAILS"
         SimOp.definedir(self, outdir)
-        outdir = self.root + outdir + self.opdate.strftime("\\%y%m%d_")
-        outdate = datetime.today()
-        outdir += str(outdate.toordinal()) + outdate.strftime("T%H%M")
+        outdir = self.root + outdir + SimOp.outstamp(self)
         mkdir(outdir)
 
-        # iterate model levels and copy results:
-        lvpath = ""
-        for level in range(self.levels):
-            lvpath += f"\\Level {level + 1}"
-
-            # input folder:
-            iptdir = self.root + lvpath + "\\res"
-            # output folder:
-            optdir = outdir + f"\\LV{level+1}_" + path.basename(iptdir)
-            # copy folder:
-            copytree(iptdir, optdir)
+        # copy the 'res' folder of each model level in parallel:
+        with ThreadPoolExecutor(max_workers=self.levels) as pool:
+            jobs = [pool.submit(copytree, self.root + lvpath + "\\res",
+                                outdir + f"\\LV{level + 1}_res")
+                    for level, lvpath in enumerate(self.lvpaths)]
+        # surface exceptions raised in the workers:
+        for job in jobs:
+            job.result()
 
         forc = self.root + "\\General Data\\Operational Forcing"
         copytree(forc, outdir + "\\Operational Forcing")
@@ -18,50 +18,52 @@ from h5py import File
 import support_xrdset as sxr
 
 
+#
+# convertble MOHID variables:
+#
+HDFVRID = {"velocity U": ('uo', 'Eastward Velocity',
+                          'eastward_sea_water_velocity'),
+           "velocity V": ('vo', 'Northward Velocity',
+                          'northward_sea_water_velocity'),
+           "velocity W": ('wo', 'Vertical Velocity',
+                          'vertical_sea_water_velocity'),
+           "velocity modulus": ('vmod', 'Velocity Modulus',
+                                'sea_water_velocity_modulus'),
+           "temperature": ('thetao', 'Temperature',
+                           'sea_water_potential_temperature'),
+           "salinity": ('so', 'Salinity', 'sea_water_salinity'),
+           "density": ('rho', 'Density', 'sea_water_density'),
+           "water level": ("ssh", "Sea Surface Height",
+                           "sea_surface_height_above_geoid")}
+#
+# convertble MOHID units:
+#
+HDFUNTS = {"ºC": ("degrees_C", 'Degrees Celsius'),
+           "?C": ("degrees_C", 'Degrees Celsius'),
+           "m/s": ('m s-1', 'Meters per Second'),
+           "psu": ('psu', 'Practical Salinity Unit'),
+           "Kg/m3": ('kg m3-1', 'Kilograms per Cubic meter'),
+           "m": ('m', 'Meters'),
+           "W/m2": ('W m2-1',  'Watt per Meter Square'),
+           "1/m": ('m-1', "Inverse Meters")}
+
+
 def mohidvars(varid):
     """varid = string with the name of MOHID variable/field
 
-       Contains, in a dictionary, the set of MOHID variables that SMS-Coastal
-       can convert. Returns a list of strings with the information of a
+       Looks up, in HDFVRID, the set of MOHID variables that SMS-Coastal
+       can convert. Returns a tuple of strings with the information of a
        single variable name in netCDF, its long name, and its standard name."""
-    #
-    # convertble MOHID variables:
-    #
-    hdfvrid = {"velocity U": ['uo', 'Eastward Velocity',
-                              'eastward_sea_water_velocity'],
-                "velocity V": ['vo', 'Northward Velocity', 
-                               'northward_sea_water_velocity'],
-                "velocity W": ['wo', 'Vertical Velocity',
-                               'vertical_sea_water_velocity'],
-                "velocity modulus": ['vmod', 'Velocity Modulus',
-                                     'sea_water_velocity_modulus'],
-                "temperature": ['thetao', 'Temperature',
-                                'sea_water_potential_temperature'],
-                "salinity": ['so', 'Salinity', 'sea_water_salinity'],
-                "density": ['rho', 'Density', 'sea_water_density'],
-                "water level": ["ssh", "Sea Surface Height",
-                                "sea_surface_height_above_geoid"]}
-    return hdfvrid.get(varid)
+    return HDFVRID.get(varid)
 
 
 def mohidunts(unit):
     """unit = string with the name of MOHID unit
        
-       Contains, in a dictionary, the set of MOHID units that SMS-Coastal can
-       convert. Returns a list of strings with the information of a single
+       Looks up, in HDFUNTS, the set of MOHID units that SMS-Coastal can
+       convert. Returns a tuple of strings with the information of a single
        unit name in netCDF, and its long name."""
-    #
-    # convertble MOHID units:
-    #
-    hdfunts = {"ºC": ["degrees_C", 'Degrees Celsius'],
-                "?C": ["degrees_C", 'Degrees Celsius'],
-                "m/s": ['m s-1', 'Meters per Second'],
-                "psu": ['psu', 'Practical Salinity Unit'],
-                "Kg/m3": ['kg m3-1', 'Kilograms per Cubic meter'],
-                "m": ['m', 'Meters'],
-                "W/m2": ['W m2-1',  'Watt per Meter Square'],
-                "1/m": ['m-1', "Inverse Meters"]}
-    return  hdfunts.get(unit)
+    return HDFUNTS.get(unit)
 
     
 def waterlevel(ohdf, keys, shpe):
@@ -90,14 +92,14 @@ def waterlevel(ohdf, keys, shpe):
         #
         # get values and mask land cells:
         #
-        dset = np.array(ohdf[key])            
-        dset = dset * opts + ((opts - 1) * 9.98e15)
+        dset = ohdf[key].astype("f4")[()]
+        np.putmask(dset, opts < 1, -9.98e15)
         dset = np.ma.masked_less(dset, -98)            
         dset = np.ma.transpose(dset, (1, 0))
         #
         # upload values to array:
         #             
-        arr[inst - 1] = dset.astype("f4")    
+        arr[inst - 1] = dset    
     return arr
 
 
@@ -115,9 +117,10 @@ def hdf2xrdset(hdfin, hdfvars=None):
     #
     xrdset = xr.Dataset({})
     #
-    # Open HDF5 in read mode and import ouput dates:
+    # Open HDF5 in read mode and import ouput dates, with a 64 MiB chunk
+    # cache so compressed grids are not decompressed again on each read:
     #
-    hdf = File(hdfin, "r")
+    hdf = File(hdfin, "r", rdcc_nbytes=64 << 20, rdcc_nslots=10007)
     keys = ['/Time/' + key for key in hdf.get('/Time')]
     dset = [np.array(hdf[key]).astype('i2') for key in keys]
     dset = [datetime(*tuple(val)) for val in dset]
@@ -132,13 +135,13 @@ def hdf2xrdset(hdfin, hdfvars=None):
 
     if dset:
         # first output key:
-        key = "/Grid/VerticalZ/" + list(dset.keys())[0]
+        key = "/Grid/VerticalZ/" + next(iter(dset))
         # get dataset and transpose to (lat, lon):
         dset = ma.masked_less(hdf.get(key), -98)[:-1].transpose()
         # [:-1] to remove surface edge (values must be cell centered)
         
         # locate cell with deepest value (lat, lon, layer):
-        vmax = np.array(np.where(dset==dset.max())).transpose()[0]
+        vmax = np.unravel_index(dset.argmax(), dset.shape)
         # get all layers for previous cell:
         dset = dset[vmax[0], vmax[1]].compressed()[::-1]
         # remove land cells qith compress and sort from shallowest to deepest
@@ -150,9 +153,9 @@ def hdf2xrdset(hdfin, hdfvars=None):
     #
     # Import latitude dimension:
     #
-    dset = np.array(hdf.get("/Grid/Latitude"))[0]
-    # bring to center cell and remove last value:
-    dset = (dset[:-1] + (dset[1] - dset[0])/2)
+    dset = hdf["/Grid/Latitude"][0]  # reads only the first row
+    # bring to center cell (midpoints between edges):
+    dset = (dset[:-1] + dset[1:])/2
     #
     # Update xrdset:
     #
@@ -160,8 +163,8 @@ def hdf2xrdset(hdfin, hdfvars=None):
     #
     # Import longitude dimension:
     #
-    dset = np.array(hdf.get("/Grid/Longitude")).transpose()[0]
-    dset = (dset[:-1] + (dset[1] - dset[0])/2)
+    dset = hdf["/Grid/Longitude"][:, 0]  # reads only the first column
+    dset = (dset[:-1] + dset[1:])/2
     #
     # Update xrdset:
     #
@@ -178,21 +181,24 @@ def hdf2xrdset(hdfin, hdfvars=None):
     #
     # variables to convert:
     #
-    convars = hdfvars if hdfvars else [var for var in hdf.get("/Results")]
+    # Results group keys, listed once:
+    hdfkeys = set(hdf["/Results"].keys())
+    convars = hdfvars if hdfvars else sorted(hdfkeys)
 
-    # extract each variable and update xrdset:
+    # extract each variable, xrdset is updated once after the loop:
+    data_vars = {}
     for var in convars:
         # variable attributes in netcdf:
         attrs = mohidvars(var)
         #
         # check if variable is convertble and if is in the HDF:
         #
-        if (not attrs) or (var not in hdf.get("/Results")):
+        if (not attrs) or (var not in hdfkeys):
             print(f"WARNING: cannot convert « {var} ».")
             continue
         
         # get netCDF variable name:
-        ncvar = attrs.pop(0)  # uo, vo, so...
+        ncvar, *attrs = attrs  # uo, vo, so...
 
         # variable group path in HDF and its keys:
         gpath = "/Results/" + var + "/"
@@ -204,7 +210,7 @@ def hdf2xrdset(hdfin, hdfvars=None):
         dset = str(np.char.decode(dset, encoding="iso8859_15"))
 
         # add units to the variabel attributes in netCDF:
-        attrs = attrs + mohidunts(dset)  # concatenate tuples
+        attrs = (*attrs, *mohidunts(dset))  # concatenate tuples
         #
         # create attributes dictionary
         #
@@ -216,24 +222,30 @@ def hdf2xrdset(hdfin, hdfvars=None):
         if var == "water level":
             dset = waterlevel(hdf, keys, shpe)
             var_dims = dims[0], dims[-2], dims[-1]
-            xrdset = xrdset.assign({ncvar: (var_dims,  dset, attrs)})
+            data_vars[ncvar] = var_dims, dset, attrs
             continue
         #
         # allocate masked array for the variable/field:
         #
         arr = ma.zeros(shpe).astype("f4")
+        #
+        # read buffers (float32), reused for every instant:
+        #
+        dset = np.empty(hdf[keys[0]].shape, "f4")
+        opts = hdf["/Grid/OpenPoints/OpenPoints_00001"].shape
+        opts = np.empty(opts, "int8")
 
         # populate dataset:
         for inst, key in enumerate(keys, 1):
             # open points for the same instant (1 sea, 0 land):
-            opts = f"/Grid/OpenPoints/OpenPoints_{inst:05d}"
-            opts = np.array(hdf[opts]).astype("int8")
+            optkey = f"/Grid/OpenPoints/OpenPoints_{inst:05d}"
+            hdf[optkey].read_direct(opts)
             # import variable/field:
-            dset = np.array(hdf[key])
-            # make land cells iqual to -9.998e15:
-            dset = dset * opts + ((opts - 1) * 9.998e15)
+            hdf[key].read_direct(dset)
+            # make land cells iqual to -9.998e15, in-place:
+            np.putmask(dset, opts < 1, -9.998e15)
             # mask all land cells:
-            dset = np.ma.masked_less(dset, -98)
+            darr = np.ma.masked_less(dset, -98)
             #
             # Dataset conversions:
             # 1. shape to (depth, latitude, longitute)
@@ -244,19 +256,20 @@ def hdf2xrdset(hdfin, hdfvars=None):
             # Note: even surface fields in MOHID HDF5 files have shape of (1, lon, lat)
             #
 
-            dset = np.ma.transpose(dset[::-1][:shpe[1]], (0, 2, 1))
+            darr = np.ma.transpose(darr[::-1][:shpe[1]], (0, 2, 1))
             #
             # remove dimension of single layer datasets:
             #
-            dset = dset[0] if (len(shpe) < 4) else dset
+            darr = darr[0] if (len(shpe) < 4) else darr
             #
-            # update variable/field masked array:
+            # update variable/field masked array (copies the values):
             #
-            arr[inst - 1] = dset.astype("f4")
-        #
-        # upload arra to xrdset:
-        #
-        xrdset = xrdset.assign({ncvar: (dims, arr, attrs)})
+            arr[inst - 1] = darr
+        data_vars[ncvar] = dims, arr, attrs
+    #
+    # upload all variables to xrdset at once:
+    #
+    xrdset = xrdset.assign(data_vars)
     #
     # close HDF5 file and return the xarray object:
     #
@@ -4,30 +4,44 @@
 #
 # Updated : 2021-10-08
 
+from functools import lru_cache
+from os import path
+
+
+@lru_cache(maxsize=8)
+def readlines(initdat, mtime):
+    """initdat = path and name of init.dat
+       mtime = modification time of init.dat, to reload changed files
+       
+       Returns a tuple with the (keyword, value) pairs of init.dat, read
+       from not empty lines with ':' and that are not comments."""
+    
+    lines = []
+    with open(initdat, "r") as dat:
+        for line in dat:
+            cond_c = line[0] == "!"
+            line = line.strip()
+
+            # skip lines:
+            if (not line) or (":" not in line) or cond_c:
+                continue
+            line = line.split(':', maxsplit=1)
+            lines.append((line[0].strip(), line[1].strip()))
+    
+    return tuple(lines)
+
 
 def readkey(smsc, key, std=None):
     """smsc = SMS-Coastal folder
        key = keyword to be read in init.dat
        std = standard values if keyword is not found"""
     
-    data = std
-    dat = open(smsc + "\\init.dat", "r")
-    line = dat.readline()
-    
-    while line:
-        cond_c = line[0] == "!"
-        line = line.strip()
-        cond_a = not line 
-        cond_b = ":" not in line
-        cond_d = key not in line
-        
-        # skip lines:
-        if cond_a or cond_b or cond_c or cond_d:
-            line = next(dat, None)
-            continue
-        
-        data = line.split(':', maxsplit=1)[1].strip()
-        line = None
-    
-    dat.close()
-    return data
+    initdat = smsc + "\\init.dat"
+    lines = readlines(initdat, path.getmtime(initdat))
+
+    # keyword is the text before the colon:
+    for head, data in lines:
+        if head == key:
+            return data
+
+    return std
@@ -6,30 +6,84 @@
 #
 
 
-from os import getcwd, path, chdir
+from os import getcwd, path, cpu_count
 from  subprocess import run
 from datetime import datetime
-from shutil import rmtree
+from shutil import rmtree, copytree
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tempfile import TemporaryDirectory
+from queue import Queue
+import mmap
 
 import numpy as np
 from h5py import File
 
 
+# MOHID tools files sets already found, only successful checks are kept:
+CHECKEDOK = set()
+
+# maximum of parallel HDF5Extractor copies (I/O bound tool):
+EXTRWORKERS = 4
+
+# MOHID Convert2netcdf dlls:
+NCDLLS = ('hdf.dll', 'hdf5.dll', 'hdf5_cpp.dll', 'hdf5_f90cstub.dll',
+          'hdf5_fortran.dll', 'hdf5_hl.dll', 'hdf5_hl_cpp.dll',
+          'hdf5_tools.dll', 'jpeg.dll', 'libcurl.dll', 'libifcoremd.dll',
+          'libmmd.dll', 'mfhdf.dll', 'msvcp120.dll', 'msvcp140.dll',
+          'msvcr120.dll', 'netcdf.dll', 'szip.dll', 'vcruntime140.dll',
+          'xdr.dll', 'zlib.dll', 'zlib1.dll')
+
+# MOHID Convert2netcdf.dat template,
+# might have to add the HDF_READ_* keywords to init.dat:
+NCDATTXT = (
+    "HDF_FILE            : {hdf}\nHDF_SIZE_GROUP       : /Grid\n"
+    "SIMPLE_GRID          : 1\nHDF_TIME_VAR         : Time\n"
+    "IMPOSE_MASK          : 1\n"
+    "HDF_SIZE_DATASET     : WaterPoints3D\n"
+    "HDF_VERT_VAR         : VerticalZ/{vertical}\n"
+    "HDF_READ_DEPTH       : 1\nHDF_READ_LATLON      : 1\n"
+    "HDF_READ_SIGMA       : 0\nDEPTH_OFFSET         : 2.28\n"
+    "CONVERT_EVERYTHING   : 1\n\n<begin_groups>\n"
+    "{fields}\n<end_groups>\n\n"
+    "NETCDF_FILE          : {ncout}\n"
+    "NETCDF_TITLE         :  MOHID converted forecast data\n"
+    "NETCDF_CONVENTION    : CF-1.6\nNETCDF_VERSION       : 4.4.1\n"
+    "NETCDF_HISTORY       : 2018/11/12 14:45:24 Maretec Netcdf "
+    "creation\nNETCDF_SOURCE        : ConvertTonetcdf - Mohid "
+    "tools\nNETCDF_INSTITUTION   : Technical University of Lisbon "
+    "- Instituto Superior Tecnico (IST) - MARETEC\n"
+    "NETCDF_REFERENCES    : http://www.maretec.org/\n"
+    "NETCDF_DATE          : 2018\n"
+    "NETCDF_COORD_SYSTEM  : ucar.nc2.dataset.conv.CF1Convention\n"
+    "NETCDF_CONTACT       : joao.sobrinho@tecnico.ulisboa.pt\n"
+    "NETCDF_FIELD_TYPE    : mean\n"
+    "NETCDF_BULLETIN_DATE : 2018-11-12 00:00:00\n"
+    "NETCDF_COMMENT       : Maretec operational modelling product\n")
+
+
 def checkfiles(files):
     """files = iterable (list/tuple) of strings with the full path of the
        files to check
        
        Function to check if file in an iterable exists."""
 
-    status = 1
+    # stops at the first missing file:
+    return 1 if all(path.isfile(file) for file in files) else None
 
-    for file in files:
-        if not status:
-            continue
 
-        if not path.isfile(file):
-            status = None
+def checkdlls(files):
+    """files = tuple of strings with the full path of the files to check
     
+       Version of 'checkfiles' for the MOHID tools files. Once all files
+       are found they are not checked again, a failed check is repeated
+       in the next call."""
+
+    if files in CHECKEDOK:
+        return 1
+
+    status = checkfiles(files)
+    if status:
+        CHECKEDOK.add(files)
     return status
 
 
@@ -39,20 +93,34 @@ def readlog(mohidlog):
        Function to read MOHID log files and determine if program has
        successfully ended."""
     
-    dat = open(mohidlog, "r")
-    line = dat.readline()
-    status = None
+    with open(mohidlog, "rb") as dat:
+        # empty files cannot be memory-mapped:
+        if not path.getsize(mohidlog):
+            return
+        
+        # search the whole file at once in the mapped bytes:
+        with mmap.mmap(dat.fileno(), 0, access=mmap.ACCESS_READ) as logmap:
+            # sequential read-ahead hint (not available on Windows):
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                logmap.madvise(mmap.MADV_SEQUENTIAL)
+            found = logmap.find(b"successfully terminated") != -1
     
-    while line:
-        if ("Program" and "successfully terminated") in line:
-            line = None
-            status = 1
-            continue
+    return 1 if found else None
+
 
-        line = next(dat, None)
+def runtool(exe):
+    """exe = string with path and name of the MOHID tool exe file
     
-    dat.close()
-    return status
+       Supporting function to run a MOHID tool in its own folder, without
+       changing the working directory. Returns the 'readlog' status."""
+
+    exedir = path.dirname(exe)
+
+    with open(exedir + "\\log_run.txt", "w") as out:
+        with open(exedir + "\\log_err.txt", "w") as err:
+            run([exe], stdout=out, stderr=err, cwd=exedir)
+
+    return readlog(exedir + "\\log_run.txt")
 
 
 def writenomfich(nomfich, inmodel):
@@ -61,11 +129,36 @@ def writenomfich(nomfich, inmodel):
        file
        
        Supporting function to write the nomfich file for different kinds
-       of MOHID pre/post processing operations."""
+       of MOHID pre/post processing operations. File is only written if
+       its content changes."""
+
+    nomfich += "\\nomfich.dat"
+    dattxt = f"ROOT_SRT     : .\\\nIN_MODEL     : .\\{inmodel}\n"
 
-    with open(nomfich + "\\nomfich.dat", "w") as dat:
-        dat.write("ROOT_SRT     : .\\\n")
-        dat.write(f"IN_MODEL     : .\\{inmodel}\n")
+    # skip writing if file is already the same:
+    if path.isfile(nomfich):
+        with open(nomfich) as dat:
+            if dat.read() == dattxt:
+                return
+
+    with open(nomfich, "w") as dat:
+        dat.write(dattxt)
+
+
+def extractone(workers, dattxt):
+    """workers = queue.Queue with the free extractor working directories
+       dattxt = string with the Extractor.dat content of the output
+       
+       Supporting function to run HDF5Extractor for a single output in a
+       free working directory. Returns the 'readlog' status."""
+
+    workdir = workers.get()
+    try:
+        with open(workdir + "\\Extractor.dat", "w") as dat:
+            dat.write(dattxt)
+        return runtool(workdir + "\\HDF5Extractor.exe")
+    finally:
+        workers.put(workdir)
 
 
 def outmerger(hdfs, tridim, fout):
@@ -88,29 +181,23 @@ def outmerger(hdfs, tridim, fout):
     # write nomfich:
     writenomfich(path.dirname(merger), "ConvertToHDF5Action.dat")
 
-    # write ConvertToHDF5Action_original.dat:
+    # write ConvertToHDF5Action.dat:
+    dattxt = "<begin_file>\nACTION         : GLUES HDF5 FILES\n"
+    dattxt += f"GLUE_IN_TIME   : 0\n3D_FILE        : {tridim}\n"
+    dattxt += f"3D_OPEN        : 1\nOUTPUTFILENAME : {fout}\n\n"
+    dattxt += "<<begin_list>>\n" + "".join(hdf + "\n" for hdf in hdfs)
+    dattxt += "<<end_list>>\n<end_file>\n"
+
     with open(path.dirname(merger) + "\\ConvertToHDF5Action.dat", "w") as dat:
-        dat.write("<begin_file>\n")
-        dat.write("ACTION         : GLUES HDF5 FILES\n") 
-        dat.write("GLUE_IN_TIME   : 0\n")
-        dat.write("3D_FILE        : " + tridim + "\n")
-        dat.write("3D_OPEN        : 1\n")
-        dat.write("OUTPUTFILENAME : " + fout + "\n\n")
-        dat.write("<<begin_list>>\n")
-        [dat.write(hdf + "\n") for hdf in hdfs]
-        dat.write("<<end_list>>\n<end_file>\n")
+        dat.write(dattxt)
 
     print("Merging MOHID hydrodynamic and water properties output files...")
-    chdir(path.dirname(merger))
-    cmd = path.basename(merger) + " > log_run.txt 2> log_err.txt"
-    run(cmd, shell=True)
+    status = runtool(merger)
 
     # check log:
-    status = readlog("log_run.txt")
     if not status:
         print("WARNING: Merging operation FAILED", end="\n\n")
     
-    chdir("..\\..\\")
     print("Merging COMPLETED.", end="\n\n")
     return status
 
@@ -134,54 +221,71 @@ def extract_outputs(mergedhdf, outdir, prefix=""):
         print("WARNING: ", end="")
         print("MOHID files missing for extraction")
         return
+
+    # the extractor runs in other folders, paths in .dat must be absolute:
+    mergedhdf = path.abspath(mergedhdf)
+    outdir = path.abspath(outdir)
     
-    # write nomfich:
-    writenomfich(path.dirname(extractor), "Extractor.dat")
-        
     # get hdf variables to extract:
     hdf = File(mergedhdf, "r")
     hdfvars = list(hdf["Results"].keys())
     
-    # get time array from hdf:
-    dates = ["/Time/" + key for key in hdf.get("/Time")]
-    dates = [np.array(hdf[key]).astype('i2') for key in dates]
-    dates = [datetime(*tuple(val)) for val in dates]
+    # get time array from hdf, read into a single preallocated array:
+    timegrp = hdf["/Time"]
+    dates = np.empty((len(timegrp), 6))
+    for inst, key in enumerate(timegrp):
+        timegrp[key].read_direct(dates[inst])
+    dates = [datetime(*val) for val in dates.astype('i2').tolist()]
     hdf.close()
         
-    # extract ouputs:
+    # parameters block, the same for every output:
+    params = ""
+    for var in hdfvars:
+        params += "\n\n<BeginParameter>\n"
+        params += f"PROPERTY      : {var}\n"
+        params += f"HDF_GROUP     : /Results/{var}\n"
+        params += "<EndParameter>"
+    params += "\n"
+
+    # Etractor.dat of each output:
+    dattxts = []
+    for inst in dates:
+        dattxt = f"FILENAME       : {mergedhdf}\n"
+        dattxt += f"OUTPUTFILENAME : {outdir}\\{prefix}"
+        dattxt += inst.strftime("%Y%m%d_%H%M.hdf5\n")
+        dattxt += inst.strftime("START_TIME     : %Y %m %d %H %M 00\n")
+        dattxt += inst.strftime("END_TIME       : %Y %m %d %H %M 01\n")
+        dattxt += "SKIP_INSTANTS  : 0" + params
+        dattxts.append(dattxt)
+
+    # extract ouputs in parallel, each worker runs in its own copy of the
+    # whole extractor folder (exe, dlls and any other file it needs):
+    nworkers = max(1, min(EXTRWORKERS, cpu_count() or 1, len(dattxts)))
+    workers = Queue()
     status = 1
-    chdir(path.dirname(extractor))
 
-    for inst in dates:
-        if not status:
-            continue
-
-        # write Etractor.dat:
-        with open("Extractor.dat", "w") as dat:
-            dat.write("FILENAME       : " + mergedhdf + "\n")
-            dat.write("OUTPUTFILENAME : " + outdir + f"\\{prefix}")
-            dat.write(inst.strftime("%Y%m%d_%H%M.hdf5\n"))
-            dat.write("START_TIME     : ")
-            dat.write(inst.strftime("%Y %m %d %H %M 00\n"))
-            dat.write("END_TIME       : ")
-            dat.write(inst.strftime("%Y %m %d %H %M 01\n"))
-            dat.write("SKIP_INSTANTS  : 0")
-
-            for var in hdfvars:
-                dat.write("\n\n<BeginParameter>\n")
-                dat.write(f"PROPERTY      : {var}\n")
-                dat.write(f"HDF_GROUP     : /Results/{var}\n")
-                dat.write("<EndParameter>")
-            
-            dat.write("\n")
-        
-        # run MOHID extractor:
-        cmd = path.basename(extractor) + " > log_run.txt 2> log_err.txt"
-        run(cmd, shell=True)
-        # check log:
-        status = readlog("log_run.txt")
+    with TemporaryDirectory() as tmpdir:
+        for wrk in range(nworkers):
+            workdir = tmpdir + f"\\worker{wrk:02d}"
+            copytree(path.dirname(extractor), workdir)
+            writenomfich(workdir, "Extractor.dat")
+            workers.put(workdir)
+
+        with ThreadPoolExecutor(nworkers) as pool:
+            jobs = {pool.submit(extractone, workers, dattxt): inst
+                    for inst, dattxt in zip(dates, dattxts)}
+
+            for job in as_completed(jobs):
+                if job.cancelled() or job.result():
+                    continue
+
+                # report every failed output, outputs not started are
+                # cancelled since the extraction is already failed:
+                print("WARNING: extraction FAILED for", jobs[job])
+                status = None
+                for other in jobs:
+                    other.cancel()
 
-    chdir("..\\..\\")
     if not status:
         print("WARNING: Extracting operation FAILED.", end="\n\n")
         rmtree(outdir)
@@ -218,17 +322,11 @@ def mergeintime(hdfs, hdfout):
     with open(path.dirname(merger) + "\\ConvertToHDF5Action.dat", "w") as dat:
         dat.write(dattxt)
 
-    # run MOHID Convert2Hdf5:
-    chdir(path.dirname(merger))
-    cmd = path.basename(merger) + " > log_run.txt 2> log_err.txt"
-    run(cmd, shell=True)
-
-    # check log:
-    status = readlog("log_run.txt")
+    # run MOHID Convert2Hdf5 and check log:
+    status = runtool(merger)
 
     if not status:
         print("WARNING: Merging operation FAILED")
-    chdir("..\\..\\")
     return status
 
 
@@ -241,14 +339,8 @@ def hdf2nc(hdf, ncout):
     # check merger exe file:
     #
     conver = getcwd() + "\\MOHID\\NetCDF\\Convert2netcdf.exe"
-    dlls = ['hdf.dll', 'hdf5.dll', 'hdf5_cpp.dll', 'hdf5_f90cstub.dll',
-            'hdf5_fortran.dll', 'hdf5_hl.dll', 'hdf5_hl_cpp.dll',
-            'hdf5_tools.dll', 'jpeg.dll', 'libcurl.dll', 'libifcoremd.dll',
-            'libmmd.dll', 'mfhdf.dll', 'msvcp120.dll', 'msvcp140.dll',
-            'msvcr120.dll', 'netcdf.dll', 'szip.dll', 'vcruntime140.dll',
-            'xdr.dll', 'zlib.dll', 'zlib1.dll']
-    dlls = [path.dirname(conver) + "\\" + dll for dll in dlls]
-    status = checkfiles([conver,] + dlls)
+    dlls = tuple(path.dirname(conver) + "\\" + dll for dll in NCDLLS)
+    status = checkdlls((conver,) + dlls)
     if not status:
         print("WARNING: ", end="")
         print("Conversion operation FAILED, MOHID file(s) not found")
@@ -261,53 +353,21 @@ def hdf2nc(hdf, ncout):
     # get field names:
     #
     with File(hdf, "r") as hdfin:
-        vertical = list(hdfin["Grid/VerticalZ"].keys())[0].split("_")[0]
+        vertical = next(iter(hdfin["Grid/VerticalZ"])).split("_")[0]
         fields = ["/Results/" + key for key in hdfin["Results"].keys()]
     #
     # write Convert2netcdf.dat:
     #
-    dattxt = f"HDF_FILE            : {hdf}\nHDF_SIZE_GROUP       : /Grid\n"
-    dattxt += "SIMPLE_GRID          : 1\nHDF_TIME_VAR         : Time\n"
-    dattxt += "IMPOSE_MASK          : 1\n"
-    dattxt += "HDF_SIZE_DATASET     : WaterPoints3D\n"
-    dattxt += f"HDF_VERT_VAR         : VerticalZ/{vertical}\n"
-    #
-    # might have to add these keywords to init.dat:
-    #
-    dattxt += "HDF_READ_DEPTH       : 1\nHDF_READ_LATLON      : 1\n"
-    dattxt += "HDF_READ_SIGMA       : 0\nDEPTH_OFFSET         : 2.28\n"
-    dattxt += "CONVERT_EVERYTHING   : 1\n\n<begin_groups>\n"
-
-    dattxt += "\n".join(fields) + "\n<end_groups>\n\n"
-    dattxt += f"NETCDF_FILE          : {ncout}\n"
-    dattxt += "NETCDF_TITLE         :  MOHID converted forecast data\n"
-    dattxt += "NETCDF_CONVENTION    : CF-1.6\nNETCDF_VERSION       : 4.4.1\n"
-    dattxt += "NETCDF_HISTORY       : 2018/11/12 14:45:24 Maretec Netcdf "
-    dattxt += "creation\nNETCDF_SOURCE        : ConvertTonetcdf - Mohid "
-    dattxt += "tools\nNETCDF_INSTITUTION   : Technical University of Lisbon "
-    dattxt += "- Instituto Superior Tecnico (IST) - MARETEC\n"
-    dattxt += "NETCDF_REFERENCES    : http://www.maretec.org/\n"
-    dattxt += "NETCDF_DATE          : 2018\n"
-    dattxt += "NETCDF_COORD_SYSTEM  : ucar.nc2.dataset.conv.CF1Convention\n"
-    dattxt += "NETCDF_CONTACT       : joao.sobrinho@tecnico.ulisboa.pt\n"
-    dattxt += "NETCDF_FIELD_TYPE    : mean\n"
-    dattxt += "NETCDF_BULLETIN_DATE : 2018-11-12 00:00:00\n"
-    dattxt += "NETCDF_COMMENT       : Maretec operational modelling product\n"
+    dattxt = NCDATTXT.format(hdf=hdf, vertical=vertical,
+                             fields="\n".join(fields), ncout=ncout)
 
     with open(path.dirname(conver) + "\\Convert2netcdf.dat", "w") as dat:
         dat.write(dattxt)
     #
-    # run MOHID Convert2netcdf:
-    #
-    chdir(path.dirname(conver))
-    cmd = path.basename(conver) + " > log_run.txt 2> log_err.txt"
-    run(cmd, shell=True)
-    #
-    # check log:
+    # run MOHID Convert2netcdf and check log:
     #
-    status = readlog("log_run.txt")
+    status = runtool(conver)
 
     if not status:
         print("WARNING: netCDF conversion operation FAILED")
-    chdir("..\\..\\")
     return status
@@ -5,8 +5,6 @@
 # Updated : 2022-01-25
 
 
-from datetime import datetime
-
 import numpy as np
 import xarray as xr
 from cftime import date2num
@@ -21,15 +19,12 @@ def xrtime(dset, xrdset):
        object. Updates 'xrdset' in-place."""
 
     # check if data is scalar an change to vectorial:
-    if np.isscalar(dset) or (not isinstance(dset, list) and not dset.shape):
-        dset = np.array([dset])    
+    dset = np.atleast_1d(dset)
 
-    # check if data is numpy.datetime64 with nanoseconds:
-    cond_a = isinstance(dset, np.ndarray)
-    if cond_a and (dset.dtype != np.dtype('datetime64[s]')):
-        dset = dset.astype('datetime64[s]')
-        dset = [datetime.fromisoformat(str(inst)) for inst in dset]
-    # list of datetime.datetime or array of cftime are fine
+    # numpy.datetime64 to datetime.datetime (converted by numpy):
+    if dset.dtype.kind == "M":
+        dset = dset.astype("datetime64[us]").astype(object)
+    # arrays of datetime.datetime or cftime are fine
 
     # print("Time dataset type:", type(dset))
     # if np.isscalar(dset): dset = np.array([dset])
@@ -56,12 +51,10 @@ def xrlat(dset, xrdset):
        xrdset = xarray.Dataset to be updated
               
        Method to write latitude array into a given xarray.Dataset object.
-       Method always change the name 'lat' to 'latitude'."""
+       Method always change the name 'lat' to 'latitude'. 'xrdset' may be
+       updated in-place, use the returned dataset."""
     
     dset = dset.astype("f4")
-    # create xrdset copy to not change original:
-    xrdset = xrdset.copy()
-    # by this the method does not update in-place
 
     # latitude attributes:
     attrs = {"valid_min": np.array([-90,]).astype('f4')[0],
@@ -94,11 +87,10 @@ def xrlon(dset, xrdset, convlon=None):
        Method to write longitude array into a given xarray.Dataset object.
        Longitude array can be converted from 0~360 to -180~180 (convlon=180)
        and vice versa (convlon=360). Method always change the name 'lon' to
-       'longitude'."""
+       'longitude'. 'xrdset' may be updated in-place, use the returned
+       dataset."""
     
     dset = dset.astype("f4")
-    # create xrdset copy to not change original:
-    xrdset = xrdset.copy()
 
     # correct longitude coordinate:
     vals = np.array([-180, 180]).astype('f4')
@@ -157,12 +149,16 @@ def xrdep(dset, xrdset):
 def xrmerge(ncs):
     """ncs = sorted list/tuple of the ncs to merge
        
-       Merges the netCDF files given in 'ncs'."""
+       Merges the netCDF files given in 'ncs'. Each file is read into
+       memory and closed, so that outputs can be written next to the
+       inputs, and all of them are merged at once."""
 
-    xrdset = xr.Dataset()
-    
+    dsets = []
     for ntc in ncs:
-        xrdset = xrdset.merge(xr.open_dataset(ntc, use_cftime=True))
+        with xr.open_dataset(ntc, use_cftime=True) as dset:
+            dsets.append(dset.load())
+
+    xrdset = xr.merge(dsets)
 
     xrtime(xrdset["time"].data, xrdset)
     return xrdset
@@ -176,15 +172,38 @@ def xrcut(grid_lims, xrdset, lat, lon):
        lon = string with the name of longitude variable in dataset
        
        Cuts 'xrdset' domain using the limits given in 'grid_lims'. Based on
-       dimensions named as 'latitude' and 'longitude'."""
-
-    slice_lat = slice(*grid_lims[:2])
-    slice_lon = slice(*grid_lims[2:])
-    xrdset.copy()
-    xrdset = xrdset.loc[{lat:slice_lat, lon:slice_lon}]
+       dimensions named as 'latitude' and 'longitude'. Coordinates are
+       sorted in ascending order if they are not."""
+
+    cuts = {}
+    for coord, lims in ((lat, grid_lims[:2]), (lon, grid_lims[2:])):
+        # sort coordinate only when needed:
+        if not xrdset.indexes[coord].is_monotonic_increasing:
+            xrdset = xrdset.sortby(coord)
+
+        # limits indexes, both included as in label slicing:
+        vals = xrdset[coord].values
+        ini = np.searchsorted(vals, lims[0], side="left")
+        fin = np.searchsorted(vals, lims[1], side="right")
+        cuts[coord] = slice(ini, fin)
+
+    xrdset = xrdset.isel(cuts)
     return xrdset
 
 
+def xrchunks(darr):
+    """darr = xarray.DataArray object
+    
+       Returns the HDF5 chunk shape for 'darr' to be used in its encoding.
+       Chunks hold one instant, up to 32 layers and up to 256x256 cells.
+       Empty dimensions get chunks of 1, netCDF4 does not accept 0."""
+
+    sizes = {"time": 1, "depth": 32}
+    chunks = [max(1, min(sizes.get(dim, 256), size)) for dim, size
+              in zip(darr.dims, darr.shape)]
+    return tuple(chunks)
+
+
 def xrencode_simple(xrdset):
     """xrdset = xarray.Dataset object
     
@@ -198,10 +217,11 @@ def xrencode_simple(xrdset):
     for var in xrdset.dims:
         encd[var] = {"dtype": np.dtype('f4'), '_FillValue': None}
 
-    # variables:    
+    # variables (light and fast compression):
     for var in xrdset.data_vars:
         encd[var] = {"dtype": np.dtype('f4'), "_FillValue": -32768,
-                     "zlib": True}
+                     "zlib": True, "complevel": 1, "shuffle": True,
+                     "chunksizes": xrchunks(xrdset[var])}
         
     return encd
 
@@ -225,22 +245,26 @@ def xrencode(xrdset, nrate):
         #
         # Stretch/compress data to the available packed range:
         #
-        vmax = xrdset[varid].max()  # xarray.DataArray object
-        vmin = xrdset[varid].min()
+        # min and max reduced together in a single compute call:
+        stats = xr.Dataset({"vmin": xrdset[varid].min(),
+                            "vmax": xrdset[varid].max()}).compute()
+        vmin = float(stats["vmin"])
+        vmax = float(stats["vmax"])
         
         # define scale factor:
-        scf = ((vmax - vmin)/(2**(nrate - 1))).astype("f4")
+        scf = np.float32((vmax - vmin)/(2**(nrate - 1)))
         scf = scf.round(4) if (-1 < scf < 1) else scf.round()
 
         # define add offset,
         # translate the range to be symmetric about zero:
-        ofs = (vmin + 2**(nrate - 1)*scf).astype("f4")
+        ofs = np.float32(vmin + 2**(nrate - 1)*scf)
         ofs = ofs.round(4) if (-1 < ofs < 1) else ofs.round()
         
         # update encoding variable:
         encd[varid] = {"dtype": np.dtype('i2'),
                         "_FillValue": -32768,
-                        "scale_factor": scf.data,
-                        "add_offset": ofs.data,
-                        "zlib": True}   
+                        "scale_factor": scf,
+                        "add_offset": ofs,
+                        "zlib": True,
+                        "chunksizes": xrchunks(xrdset[varid])}   
     return encd
\ No newline at end of file